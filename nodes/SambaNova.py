@@ -2,7 +2,7 @@ import os
 import configparser
 import json
 import logging
-from ..utils.api_utils import make_api_request, make_streaming_request
+from ..utils.api_utils import EndpointPool, get_endpoint_pool, make_pooled_request, make_pooled_streaming_request
 from ..utils.chat_utils import ChatHistoryManager
 from ..utils.prompt_utils import load_prompt_options, format_prompt
 
@@ -36,6 +36,51 @@ class SambaNovaLLMNode:
         else:
             logger.warning(f"Config file not found at {self.config_path}. Using default values.")
             self.config['API'] = {'key': '', 'base_url': 'https://api.sambanova.ai/v1', 'max_retries': '3'}
+        self.endpoint_pool = self.build_endpoint_pool()
+
+    @staticmethod
+    def split_config_list(value):
+        return [item.strip() for item in value.replace('\n', ',').split(',') if item.strip()]
+
+    def get_config_float(self, option, default):
+        try:
+            value = self.config.getfloat('API', option, fallback=default)
+        except ValueError:
+            value = -1
+        if value < 0:
+            logger.warning(f"Invalid '{option}' in {self.config_path}, using {default}.")
+            return default
+        return value
+
+    def build_endpoint_pool(self):
+        api_keys = self.split_config_list(self.config.get('API', 'key', fallback=''))
+        base_urls = self.split_config_list(self.config.get('API', 'base_url', fallback='https://api.sambanova.ai/v1'))
+        if not api_keys:
+            return None
+
+        weights = self.split_config_list(self.config.get('API', 'weights', fallback=''))
+        if weights and not (len(weights) == len(api_keys) and all(w.isdigit() and int(w) > 0 for w in weights)):
+            logger.warning(f"Invalid 'weights' in {self.config_path}: expected {len(api_keys)} positive "
+                           f"whole numbers, one per key. Using equal weights.")
+            weights = []
+
+        strategy = self.config.get('API', 'balancing_strategy', fallback='least_outstanding').strip()
+        if strategy not in EndpointPool.STRATEGIES:
+            logger.warning(f"Invalid 'balancing_strategy' '{strategy}' in {self.config_path}, expected one of "
+                           f"{EndpointPool.STRATEGIES}. Using least_outstanding.")
+            strategy = 'least_outstanding'
+
+        endpoint_pool = get_endpoint_pool(
+            api_keys,
+            base_urls,
+            weights=[int(w) for w in weights] or None,
+            strategy=strategy,
+            rate_limit_cooldown=self.get_config_float('rate_limit_cooldown', 5.0),
+            auth_error_cooldown=self.get_config_float('auth_error_cooldown', 300.0),
+        )
+        logger.info(f"Using {len(api_keys)} API key(s) across {len(base_urls)} base URL(s) "
+                    f"with {endpoint_pool.strategy} balancing")
+        return endpoint_pool
 
     @classmethod
     def INPUT_TYPES(cls):
@@ -66,18 +111,11 @@ class SambaNovaLLMNode:
     def generate_text(self, prompt, model, max_tokens, temperature, top_p, top_k, request_type,
                       system_message="", stop_sequences="", conversation_id="",
                       repetition_penalty=1.0, stream=False):
-        api_key = self.config.get('API', 'key', fallback='')
-        base_url = self.config.get('API', 'base_url', fallback='https://api.sambanova.ai/v1')
         max_retries = int(self.config.get('API', 'max_retries', fallback='3'))
 
-        if not api_key:
+        if self.endpoint_pool is None:
             raise ValueError("API key is not set in the SambaNovaConfig.ini file.")
 
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-
         if not conversation_id:
             conversation_id = self.chat_history_manager.create_new_conversation()
         
@@ -103,24 +141,24 @@ class SambaNovaLLMNode:
             for message in conversation_history:
                 data["messages"].append(message)
             data["messages"].append({"role": "user", "content": prompt})
-            endpoint = f"{base_url}/chat/completions"
+            endpoint = "chat/completions"
         else:  # completion
             full_prompt = format_prompt(system_message, conversation_history, prompt)
             data["prompt"] = full_prompt
-            endpoint = f"{base_url}/completions"
+            endpoint = "completions"
 
         if stream:
-            generated_text, token_count = self.handle_streaming_response(data, headers, endpoint, conversation_id)
+            generated_text, token_count = self.handle_streaming_response(data, endpoint, max_retries, conversation_id)
         else:
-            generated_text, token_count = self.handle_non_streaming_response(data, headers, endpoint, max_retries, request_type, conversation_id, prompt)
+            generated_text, token_count = self.handle_non_streaming_response(data, endpoint, max_retries, request_type, conversation_id, prompt)
 
         self.update_chat_history(conversation_id, prompt, generated_text)
         return (generated_text, token_count, conversation_id)
 
-    def handle_streaming_response(self, data, headers, endpoint, conversation_id):
+    def handle_streaming_response(self, data, endpoint, max_retries, conversation_id):
         generated_text = ""
         token_count = 0
-        for chunk in make_streaming_request(data, headers, endpoint):
+        for chunk in make_pooled_streaming_request(data, self.endpoint_pool, endpoint, max_retries):
             if chunk.startswith("Error:"):
                 logger.error(chunk)
                 return chunk, 0
@@ -128,8 +166,8 @@ class SambaNovaLLMNode:
             token_count += 1  # This is still an approximation
         return generated_text, token_count
 
-    def handle_non_streaming_response(self, data, headers, endpoint, max_retries, request_type, conversation_id, prompt):
-        response, success, status_code = make_api_request(data, headers, endpoint, max_retries)
+    def handle_non_streaming_response(self, data, endpoint, max_retries, request_type, conversation_id, prompt):
+        response, success, status_code = make_pooled_request(data, self.endpoint_pool, endpoint, max_retries)
 
         if success:
             if request_type == "chat":
@@ -0,0 +1,215 @@
+import pytest
+import requests
+
+from utils import api_utils
+from utils.api_utils import EndpointPool, make_pooled_request, make_pooled_streaming_request
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None, body=None, lines=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body if body is not None else {"choices": [{"text": "ok"}]}
+        self.text = str(self.body)
+        self.reason = {200: "OK", 401: "Unauthorized", 429: "Too Many Requests",
+                       503: "Service Unavailable"}.get(status_code, "Error")
+        self.lines = lines or []
+
+    def json(self):
+        return self.body
+
+    def iter_lines(self):
+        for line in self.lines:
+            if isinstance(line, Exception):
+                raise line
+            yield line
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(api_utils.time, "monotonic", fake.monotonic)
+    monkeypatch.setattr(api_utils.time, "sleep", fake.sleep)
+    return fake
+
+
+def fake_post(monkeypatch, handler):
+    calls = []
+
+    def post(url, headers, json, **kwargs):
+        key = headers["Authorization"][len("Bearer "):]
+        calls.append((key, url))
+        return handler(key, url)
+
+    monkeypatch.setattr(api_utils.requests, "post", post)
+    return calls
+
+
+def test_weighted_round_robin_spreads_by_weight(clock):
+    pool = EndpointPool(["k1", "k2"], ["https://a"], weights=[3, 1], strategy="weighted_round_robin")
+    picks = []
+    for _ in range(8):
+        endpoint = pool.acquire()
+        picks.append(endpoint.api_key)
+        pool.release(endpoint, 200)
+    assert picks.count("k1") == 6
+    assert picks.count("k2") == 2
+
+
+def test_rate_limit_moves_to_next_key_until_retry_after(monkeypatch, clock):
+    pool = EndpointPool(["k1", "k2"], ["https://a"])
+    limited = {"k1"}
+    calls = fake_post(monkeypatch, lambda key, url: FakeResponse(429, {"Retry-After": "10"})
+                      if key in limited else FakeResponse(200))
+
+    response, success, status = make_pooled_request({}, pool, "completions", 3)
+    assert success and status == "200 OK"
+    assert [key for key, _ in calls] == ["k1", "k2"]
+
+    make_pooled_request({}, pool, "completions", 3)
+    assert calls[-1][0] == "k2"
+
+    limited.clear()
+    clock.now += 10
+    keys = set()
+    for _ in range(4):
+        make_pooled_request({}, pool, "completions", 3)
+        keys.add(calls[-1][0])
+    assert keys == {"k1", "k2"}
+
+
+def test_quota_exhausted_uses_reset_header(monkeypatch, clock):
+    pool = EndpointPool(["k1"], ["https://a"])
+    fake_post(monkeypatch, lambda key, url: FakeResponse(200, {"x-ratelimit-remaining-requests": "0",
+                                                               "x-ratelimit-reset-requests": "1m"}))
+    make_pooled_request({}, pool, "completions", 1)
+    assert pool.next_available_in() == 60
+
+
+def test_auth_error_rests_only_the_failing_pair(monkeypatch, clock):
+    pool = EndpointPool(["k1"], ["https://us", "https://eu"], auth_error_cooldown=300)
+    calls = fake_post(monkeypatch, lambda key, url: FakeResponse(401, body={"error": "bad key"})
+                      if "eu" in url else FakeResponse(200))
+
+    for _ in range(4):
+        response, success, status = make_pooled_request({}, pool, "completions", 3)
+        assert success
+    assert [url for _, url in calls].count("https://eu/completions") == 1
+
+
+def test_auth_error_returns_server_message(monkeypatch, clock):
+    pool = EndpointPool(["k1"], ["https://a"])
+    calls = fake_post(monkeypatch, lambda key, url: FakeResponse(401, body={"error": "bad key"}))
+
+    response, success, status = make_pooled_request({}, pool, "completions", 3)
+    assert not success
+    assert status == "401 Unauthorized"
+    assert "bad key" in response
+    assert len(calls) == 1
+
+    response, success, status = make_pooled_request({}, pool, "completions", 3)
+    assert status == "No available endpoint"
+    assert "401" in response and "bad key" in response
+    assert len(calls) == 1
+
+
+def test_connection_errors_back_off_single_pair(monkeypatch, clock):
+    pool = EndpointPool(["k1", "k2"], ["https://a"])
+
+    def handler(key, url):
+        if key == "k1":
+            raise requests.ConnectionError("down")
+        return FakeResponse(200)
+
+    fake_post(monkeypatch, handler)
+    k1 = next(e for e in pool.endpoints if e.api_key == "k1")
+    k2 = next(e for e in pool.endpoints if e.api_key == "k2")
+    cooldowns = []
+    for _ in range(3):
+        clock.now = max(clock.now, k1.disabled_until)
+        make_pooled_request({}, pool, "completions", 2)
+        cooldowns.append(k1.disabled_until - clock.now)
+    assert cooldowns == [1, 2, 4]
+    assert k2.disabled_until == 0.0
+    assert "k1" not in pool.key_disabled_until
+
+
+def test_server_errors_fail_over_and_back_off_single_pair(monkeypatch, clock):
+    pool = EndpointPool(["k1"], ["https://us", "https://eu"])
+    calls = fake_post(monkeypatch, lambda key, url: FakeResponse(503, body={"error": "unavailable"})
+                      if "eu" in url else FakeResponse(200))
+
+    for _ in range(10):
+        response, success, status = make_pooled_request({}, pool, "completions", 3)
+        assert success
+    assert [url for _, url in calls].count("https://eu/completions") == 1
+    eu = next(e for e in pool.endpoints if "eu" in e.base_url)
+    assert eu.disabled_until - clock.now == 1
+    assert "k1" not in pool.key_disabled_until
+
+
+def test_server_error_returned_when_every_endpoint_fails(monkeypatch, clock):
+    pool = EndpointPool(["k1"], ["https://us", "https://eu"])
+    fake_post(monkeypatch, lambda key, url: FakeResponse(503, body={"error": "unavailable"}))
+
+    response, success, status = make_pooled_request({}, pool, "completions", 2)
+    assert not success
+    assert status == "503 Service Unavailable"
+    assert "unavailable" in response
+
+
+def test_streaming_fails_over_before_first_chunk(monkeypatch, clock):
+    pool = EndpointPool(["k1", "k2"], ["https://a"])
+    lines = [b'data: {"choices": [{"delta": {"content": "hi"}}]}', b"data: [DONE]"]
+    calls = fake_post(monkeypatch, lambda key, url: FakeResponse(429) if key == "k1"
+                      else FakeResponse(200, lines=lines))
+
+    chunks = list(make_pooled_streaming_request({}, pool, "chat/completions", 3))
+    assert chunks == ["hi"]
+    assert [key for key, _ in calls] == ["k1", "k2"]
+
+
+def test_streaming_fails_over_on_server_error(monkeypatch, clock):
+    pool = EndpointPool(["k1"], ["https://us", "https://eu"])
+    lines = [b'data: {"choices": [{"delta": {"content": "hi"}}]}', b"data: [DONE]"]
+    calls = fake_post(monkeypatch, lambda key, url: FakeResponse(503) if "eu" in url
+                      else FakeResponse(200, lines=lines))
+
+    for _ in range(3):
+        assert list(make_pooled_streaming_request({}, pool, "chat/completions", 3)) == ["hi"]
+    assert [url for _, url in calls].count("https://eu/chat/completions") == 1
+
+
+def test_streaming_broken_before_first_chunk_backs_off_pair(monkeypatch, clock):
+    pool = EndpointPool(["k1", "k2"], ["https://a"])
+    lines = [b'data: {"choices": [{"delta": {"content": "hi"}}]}', b"data: [DONE]"]
+    timeouts = []
+
+    def post(url, headers, json, **kwargs):
+        timeouts.append(kwargs.get("timeout"))
+        if headers["Authorization"] == "Bearer k1":
+            return FakeResponse(200, lines=[requests.exceptions.ChunkedEncodingError("broken")])
+        return FakeResponse(200, lines=lines)
+
+    monkeypatch.setattr(api_utils.requests, "post", post)
+    assert list(make_pooled_streaming_request({}, pool, "chat/completions", 3)) == ["hi"]
+    k1 = next(e for e in pool.endpoints if e.api_key == "k1")
+    assert k1.disabled_until - clock.now == 1
+    assert timeouts == [30, 30]
@@ -1,3 +1,3 @@
-from .api_utils import make_api_request
+from .api_utils import make_api_request, make_pooled_request, EndpointPool
 from .chat_utils import ChatHistoryManager
 from .prompt_utils import load_prompt_options, get_prompt_content
\ No newline at end of file
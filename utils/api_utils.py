@@ -2,12 +2,50 @@ import requests
 import json
 import time
 import logging
-from typing import Dict, Any, Generator, Tuple
+import re
+import threading
+from typing import Dict, Any, Generator, List, Optional, Tuple
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def parse_completion_response(response: requests.Response) -> Tuple[Any, bool, str]:
+    try:
+        response_json = response.json()
+        if 'choices' in response_json and response_json['choices']:
+            return response_json, True, "200 OK"
+        else:
+            logger.warning("No valid response content found.")
+            return "No valid response content found.", False, "200 OK but no content"
+    except json.JSONDecodeError as e:
+        logger.error(f"Error parsing JSON response: {str(e)}")
+        return "Error parsing JSON response.", False, "200 OK but failed to parse JSON"
+
+def iter_stream_content(response: requests.Response) -> Generator[str, None, None]:
+    for line in response.iter_lines():
+        if line:
+            line = line.decode('utf-8')
+            if line.startswith("data: "):
+                if line.strip() == "data: [DONE]":
+                    logger.debug("Received end of stream")
+                    break
+                try:
+                    json_str = line[len("data: "):]
+                    parsed_line = json.loads(json_str)
+                    if 'choices' in parsed_line and parsed_line['choices']:
+                        content = parsed_line['choices'][0]['delta'].get('content', '')
+                        if content:
+                            yield content
+                    else:
+                        logger.warning(f"Unexpected response format: {parsed_line}")
+                except json.JSONDecodeError:
+                    logger.error(f"Failed to parse JSON: {json_str}")
+            else:
+                logger.warning(f"Unexpected line format: {line}")
+        else:
+            logger.debug("Received empty line in streaming response")
+
 def make_api_request(data: Dict[str, Any], headers: Dict[str, str], url: str, max_retries: int) -> Tuple[Any, bool, str]:
     for attempt in range(max_retries):
         try:
@@ -17,16 +55,7 @@ def make_api_request(data: Dict[str, Any], headers: Dict[str, str], url: str, ma
             logger.debug(f"Response body: {response.text}")
             
             if response.status_code == 200:
-                try:
-                    response_json = response.json()
-                    if 'choices' in response_json and response_json['choices']:
-                        return response_json, True, "200 OK"
-                    else:
-                        logger.warning("No valid response content found.")
-                        return "No valid response content found.", False, "200 OK but no content"
-                except json.JSONDecodeError as e:
-                    logger.error(f"Error parsing JSON response: {str(e)}")
-                    return "Error parsing JSON response.", False, "200 OK but failed to parse JSON"
+                return parse_completion_response(response)
             elif response.status_code == 429:
                 logger.warning("Rate limit exceeded. Retrying after delay.")
                 retry_after = int(response.headers.get('Retry-After', 5))
@@ -47,28 +76,7 @@ def make_streaming_request(data: Dict[str, Any], headers: Dict[str, str], url: s
     try:
         with requests.post(url, headers=headers, json=data, stream=True) as response:
             if response.status_code == 200:
-                for line in response.iter_lines():
-                    if line:
-                        line = line.decode('utf-8')
-                        if line.startswith("data: "):
-                            if line.strip() == "data: [DONE]":
-                                logger.debug("Received end of stream")
-                                break
-                            try:
-                                json_str = line[len("data: "):]
-                                parsed_line = json.loads(json_str)
-                                if 'choices' in parsed_line and parsed_line['choices']:
-                                    content = parsed_line['choices'][0]['delta'].get('content', '')
-                                    if content:
-                                        yield content
-                                else:
-                                    logger.warning(f"Unexpected response format: {parsed_line}")
-                            except json.JSONDecodeError:
-                                logger.error(f"Failed to parse JSON: {json_str}")
-                        else:
-                            logger.warning(f"Unexpected line format: {line}")
-                    else:
-                        logger.debug("Received empty line in streaming response")
+                yield from iter_stream_content(response)
             else:
                 error_message = f"Streaming request failed with status code {response.status_code}"
                 logger.error(error_message)
@@ -78,6 +86,293 @@ def make_streaming_request(data: Dict[str, Any], headers: Dict[str, str], url: s
         logger.error(error_message)
         yield f"Error: {error_message}"
 
+MAX_CONNECTION_BACKOFF = 60.0
+SERVER_ERROR_STATUS_CODES = (500, 502, 503, 504)
+RETRYABLE_STATUS_CODES = (401, 403, 429) + SERVER_ERROR_STATUS_CODES
+
+def parse_reset_seconds(value: Optional[str]) -> Optional[float]:
+    """
+    Parses a rate limit reset header into seconds from now. Accepts plain seconds,
+    a unix timestamp, or a duration such as "1m30s" or "250ms".
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        seconds = float(value)
+        # Values this large are unix timestamps rather than durations
+        return max(0.0, seconds - time.time()) if seconds > 1e9 else max(0.0, seconds)
+    except ValueError:
+        pass
+    units = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+    matches = re.findall(r"(\d+(?:\.\d+)?)(ms|s|m|h)", value)
+    if not matches or "".join(number + unit for number, unit in matches) != value:
+        return None
+    return sum(float(number) * units[unit] for number, unit in matches)
+
+class ApiEndpoint:
+    """A single API key paired with a base URL, plus its live health state."""
+
+    def __init__(self, api_key: str, base_url: str, weight: int = 1):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip('/')
+        self.weight = max(1, weight)
+        self.in_flight = 0
+        self.total_requests = 0
+        self.consecutive_failures = 0
+        self.current_weight = 0
+        self.disabled_until = 0.0
+        self.last_status: Optional[int] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}/{path.lstrip('/')}"
+
+    def __repr__(self) -> str:
+        return f"ApiEndpoint(key=...{self.api_key[-4:]}, base_url={self.base_url})"
+
+class EndpointPool:
+    """
+    Spreads requests across every combination of the configured API keys and base URLs.
+
+    Endpoints are picked by least outstanding requests or by smooth weighted round-robin.
+    Rate limits (429, or no requests left in the quota) take the key out of rotation on
+    every base URL, since quota belongs to the key. Auth errors (401/403) only rest the
+    failing key/URL pair, so a project key that is only valid in its own region keeps
+    serving there. Connection errors and 5xx responses back the pair off exponentially.
+    """
+
+    STRATEGIES = ("least_outstanding", "weighted_round_robin")
+
+    def __init__(self, api_keys: List[str], base_urls: List[str], weights: Optional[List[int]] = None,
+                 strategy: str = "least_outstanding", rate_limit_cooldown: float = 5.0,
+                 auth_error_cooldown: float = 300.0):
+        if not api_keys:
+            raise ValueError("EndpointPool requires at least one API key.")
+        if not base_urls:
+            raise ValueError("EndpointPool requires at least one base URL.")
+        if weights and len(weights) != len(api_keys):
+            raise ValueError("Number of weights must match the number of API keys.")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown balancing strategy '{strategy}'. Expected one of {self.STRATEGIES}.")
+
+        weights = weights or [1] * len(api_keys)
+        self.endpoints = [ApiEndpoint(key, url, weight)
+                          for key, weight in zip(api_keys, weights)
+                          for url in base_urls]
+        self.strategy = strategy
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.auth_error_cooldown = auth_error_cooldown
+        self.key_disabled_until: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def _available_at(self, endpoint: ApiEndpoint) -> float:
+        return max(self.key_disabled_until.get(endpoint.api_key, 0.0), endpoint.disabled_until)
+
+    def acquire(self) -> Optional[ApiEndpoint]:
+        with self.lock:
+            now = time.monotonic()
+            available = [e for e in self.endpoints if self._available_at(e) <= now]
+            if not available:
+                return None
+
+            if self.strategy == "weighted_round_robin":
+                total_weight = sum(e.weight for e in available)
+                for e in available:
+                    e.current_weight += e.weight
+                endpoint = max(available, key=lambda e: e.current_weight)
+                endpoint.current_weight -= total_weight
+            else:
+                endpoint = min(available, key=lambda e: (e.in_flight / e.weight, e.total_requests / e.weight))
+
+            endpoint.in_flight += 1
+            endpoint.total_requests += 1
+            return endpoint
+
+    def release(self, endpoint: ApiEndpoint, status_code: Optional[int],
+                response_headers: Optional[Dict[str, str]] = None, error: Optional[str] = None) -> None:
+        """Return an endpoint to the pool, recording the outcome of the request made with it."""
+        response_headers = response_headers or {}
+        with self.lock:
+            endpoint.in_flight = max(0, endpoint.in_flight - 1)
+            endpoint.last_status = status_code
+            endpoint.last_error = error
+            now = time.monotonic()
+
+            if status_code is None or status_code in SERVER_ERROR_STATUS_CODES:
+                endpoint.consecutive_failures += 1
+                cooldown = min(2 ** (endpoint.consecutive_failures - 1), MAX_CONNECTION_BACKOFF)
+                endpoint.disabled_until = now + cooldown
+                reason = "unreachable" if status_code is None else f"returned {status_code}"
+                logger.warning(f"{endpoint} {reason}, out of rotation for {cooldown}s")
+                return
+
+            endpoint.consecutive_failures = 0
+            out_of_quota = str(response_headers.get('x-ratelimit-remaining-requests', '')).strip() == "0"
+
+            if status_code == 429 or (status_code == 200 and out_of_quota):
+                cooldown = parse_reset_seconds(response_headers.get('Retry-After'))
+                if cooldown is None:
+                    cooldown = parse_reset_seconds(response_headers.get('x-ratelimit-reset-requests'))
+                if cooldown is None:
+                    cooldown = self.rate_limit_cooldown
+                self.key_disabled_until[endpoint.api_key] = now + cooldown
+                logger.warning(f"{endpoint} rate limited, key out of rotation for {cooldown}s")
+            elif status_code in (401, 403):
+                endpoint.disabled_until = now + self.auth_error_cooldown
+                logger.error(f"{endpoint} rejected the API key ({status_code}), "
+                             f"out of rotation for {self.auth_error_cooldown}s")
+
+    def next_available_in(self) -> float:
+        with self.lock:
+            now = time.monotonic()
+            return max(0.0, min(self._available_at(e) for e in self.endpoints) - now)
+
+    def last_failure(self) -> Optional[Tuple[str, str]]:
+        """Returns the error body and status of the endpoint that will recover first, if it has failed."""
+        with self.lock:
+            endpoint = min(self.endpoints, key=self._available_at)
+            if endpoint.last_error is None:
+                return None
+            status = str(endpoint.last_status) if endpoint.last_status is not None else "Connection error"
+            return endpoint.last_error, status
+
+_endpoint_pools: Dict[Tuple[Any, ...], EndpointPool] = {}
+_endpoint_pools_lock = threading.Lock()
+
+def get_endpoint_pool(api_keys: List[str], base_urls: List[str], weights: Optional[List[int]] = None,
+                      strategy: str = "least_outstanding", rate_limit_cooldown: float = 5.0,
+                      auth_error_cooldown: float = 300.0) -> EndpointPool:
+    """
+    Returns the process-wide pool for this configuration, so every node sharing the
+    same keys also shares their health, cooldowns and outstanding request counts.
+    """
+    cache_key = (tuple(api_keys), tuple(base_urls), tuple(weights or ()), strategy,
+                 rate_limit_cooldown, auth_error_cooldown)
+    with _endpoint_pools_lock:
+        if cache_key not in _endpoint_pools:
+            _endpoint_pools[cache_key] = EndpointPool(api_keys, base_urls, weights, strategy,
+                                                      rate_limit_cooldown, auth_error_cooldown)
+        return _endpoint_pools[cache_key]
+
+def _wait_for_endpoint(pool: EndpointPool, max_wait: float) -> Optional[ApiEndpoint]:
+    endpoint = pool.acquire()
+    if endpoint is None:
+        wait = pool.next_available_in()
+        if wait > max_wait:
+            return None
+        logger.info(f"All endpoints cooling down, waiting {wait:.1f}s")
+        time.sleep(wait)
+        endpoint = pool.acquire()
+    return endpoint
+
+def _no_endpoint_error(pool: EndpointPool) -> Tuple[str, str]:
+    wait = pool.next_available_in()
+    failure = pool.last_failure()
+    if failure is not None:
+        error, status = failure
+        return f"All API keys are resting for another {wait:.0f}s after: {status} {error}", "No available endpoint"
+    return f"All API keys are resting for another {wait:.0f}s.", "No available endpoint"
+
+def make_pooled_request(data: Dict[str, Any], pool: EndpointPool, path: str, max_retries: int,
+                        max_wait: float = 60.0) -> Tuple[Any, bool, str]:
+    last_failure = None
+    request_sent = False
+    for attempt in range(max_retries):
+        endpoint = _wait_for_endpoint(pool, max_wait)
+        if endpoint is None:
+            break
+
+        status_code = None
+        response_headers = {}
+        error = None
+        request_sent = True
+        try:
+            response = requests.post(endpoint.url(path), headers=endpoint.headers, json=data, timeout=30)
+            status_code = response.status_code
+            response_headers = response.headers
+            logger.info(f"Response status from {endpoint}: {response.status_code}")
+            logger.debug(f"Response headers: {response.headers}")
+            logger.debug(f"Response body: {response.text}")
+
+            if response.status_code == 200:
+                return parse_completion_response(response)
+            elif response.status_code in RETRYABLE_STATUS_CODES:
+                logger.warning(f"Request to {endpoint} failed with status code {response.status_code}. "
+                               f"Retrying on another endpoint.")
+                error = response.text
+                last_failure = (response.text, False, f"{response.status_code} {response.reason}")
+            else:
+                logger.error(f"Request failed with status code {response.status_code}")
+                return response.text, False, f"{response.status_code} {response.reason}"
+        except requests.RequestException as e:
+            logger.error(f"Request to {endpoint} failed on attempt {attempt + 1}: {str(e)}")
+            error = str(e)
+        finally:
+            pool.release(endpoint, status_code, response_headers, error)
+
+    if last_failure is not None:
+        return last_failure
+    if not request_sent:
+        message, status = _no_endpoint_error(pool)
+        logger.error(message)
+        return message, False, status
+    logger.error("Failed after all retries.")
+    return "Failed after all retries.", False, "Failed after all retries"
+
+def make_pooled_streaming_request(data: Dict[str, Any], pool: EndpointPool, path: str, max_retries: int,
+                                  max_wait: float = 60.0) -> Generator[str, None, None]:
+    error_message = None
+    for attempt in range(max_retries):
+        endpoint = _wait_for_endpoint(pool, max_wait)
+        if endpoint is None:
+            if error_message is None:
+                error_message, _ = _no_endpoint_error(pool)
+                error_message = f"Streaming request failed: {error_message}"
+            break
+
+        status_code = None
+        response_headers = {}
+        error = None
+        started = False
+        try:
+            with requests.post(endpoint.url(path), headers=endpoint.headers, json=data, stream=True,
+                               timeout=30) as response:
+                status_code = response.status_code
+                response_headers = response.headers
+                if response.status_code == 200:
+                    for content in iter_stream_content(response):
+                        started = True
+                        yield content
+                    return
+                error = response.text
+                error_message = f"Streaming request failed with status code {response.status_code}: {response.text}"
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    break
+                logger.warning(f"{error_message}. Retrying on another endpoint.")
+        except requests.RequestException as e:
+            error_message = f"Streaming request failed: {str(e)}"
+            if started:
+                break
+            # The stream broke before any content, so treat it as an unreachable endpoint
+            status_code = None
+            error = str(e)
+            logger.warning(f"Streaming request to {endpoint} failed on attempt {attempt + 1}: {str(e)}")
+        finally:
+            pool.release(endpoint, status_code, response_headers, error)
+
+    if error_message is None:
+        error_message = "Streaming request failed after all retries"
+    logger.error(error_message)
+    yield f"Error: {error_message}"
+
 def validate_api_key(api_key: str, base_url: str) -> bool:
     headers = {
         "Authorization": f"Bearer {api_key}",